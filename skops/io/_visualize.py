@@ -72,67 +72,64 @@ def _get_node_label(
     node: NodeInfo,
     tag_safe: str = "",
     tag_unsafe: str = "[UNSAFE]",
-    use_colors: bool = True,
-    # use rich for coloring
-    color_safe: str = "green",
-    color_unsafe: str = "red",
-    color_child_unsafe: str = "yellow",
-):
+) -> str:
     """Determine the label of a node.
 
     Nodes are labeled differently based on how they're trusted.
 
     """
-    # note: when changing the arguments to this function, also update the
-    # docstring of visualize!
-
-    if use_colors:
-        try:
-            import rich  # noqa
-        except ImportError:
-            use_colors = False
-
     # add tag if necessary
     node_val = node.val
     tag = tag_safe if node.is_self_safe else tag_unsafe
     if tag:
         node_val += f" {tag}"
+    return node_val
 
-    # colorize if so desired and if rich is installed
-    if use_colors:
-        if node.is_safe:
-            color = color_safe
-        elif node.is_self_safe:
-            color = color_child_unsafe
-        else:
-            color = color_unsafe
-        node_val = f"[{color}]{node_val}"
 
-    return node_val
+def _get_node_style(
+    node: NodeInfo,
+    color_safe: str,
+    color_unsafe: str,
+    color_child_unsafe: str,
+) -> str:
+    """Determine the style of a node.
+
+    Nodes are styled differently based on how they're trusted.
+
+    """
+    if node.is_safe:
+        return color_safe
+    if node.is_self_safe:
+        return color_child_unsafe
+    return color_unsafe
 
 
 def pretty_print_tree(
     nodes_iter: Iterator[NodeInfo],
     show: Literal["all", "untrusted", "trusted"],
-    **kwargs,
+    tag_safe: str = "",
+    tag_unsafe: str = "[UNSAFE]",
+    use_colors: bool = True,
+    # use rich for coloring
+    color_safe: str = "green",
+    color_unsafe: str = "red",
+    color_child_unsafe: str = "yellow",
 ) -> None:
     # This function loops through the flattened nodes of the tree and creates a
     # tree visualization based on the node information. If rich is installed,
     # nodes can be colored.
 
-    print_ = print
-    try:
-        import rich
+    # note: when changing the arguments to this function, also update the
+    # docstring of visualize!
 
-        # use rich for printing if available
-        print_ = rich.print  # type: ignore
-    except ImportError:
-        pass
+    # The tree is printed in one go at the end, since calling print (especially
+    # rich.print) once per node is slow for big trees. Therefore, first collect
+    # the beginning of each line, i.e. the branches and key, with its node.
+    heads: list[tuple[str, NodeInfo]] = []
 
     # start with root node
     node = next(nodes_iter)
-    label = _get_node_label(node, **kwargs)
-    print_(f"{node.key}: {label}")
+    heads.append((f"{node.key}: ", node))
     prev_level = node.level  # should be 0
     prefix = ""
 
@@ -163,19 +160,60 @@ def pretty_print_tree(
             # up 2 layers of nesting, therefore, we trunce 3-2+1 = 2 times.
             prefix = prefix[:-4]
 
-        print_(prefix, end="")
         if node.is_last:
-            print_("└──", end="")
-            prefix += "    "
+            branch = "└──"
+            next_prefix = prefix + "    "
         else:
-            print_("├──", end="")
-            prefix += "│   "
+            branch = "├──"
+            next_prefix = prefix + "│   "
 
-        label = _get_node_label(node, **kwargs)
-        print_(f" {node.key}: {label}")
+        heads.append((f"{prefix}{branch} {node.key}: ", node))
 
+        prefix = next_prefix
         prev_level = node.level
 
+    lines = [
+        (head, _get_node_label(node, tag_safe=tag_safe, tag_unsafe=tag_unsafe), node)
+        for head, node in heads
+    ]
+
+    try:
+        from rich import get_console
+        from rich.text import Text
+    except ImportError:
+        # rich is not installed, print without colors
+        print("\n".join(head + label for head, label, _ in lines))
+        return
+
+    if use_colors:
+        # The colors are attached directly to the text as styles, instead of
+        # having rich parse color markup for each node. As with markup, rich
+        # resolves them when rendering, so unknown colors are ignored and theme
+        # styles work.
+        text = Text("\n").join(
+            Text.assemble(
+                head,
+                (
+                    label,
+                    _get_node_style(
+                        node,
+                        color_safe=color_safe,
+                        color_unsafe=color_unsafe,
+                        color_child_unsafe=color_child_unsafe,
+                    ),
+                ),
+            )
+            for head, label, node in lines
+        )
+    else:
+        # still pass a Text, so that keys and values are not interpreted as
+        # markup by rich, same as when using colors
+        text = Text("\n".join(head + label for head, label, _ in lines))
+
+    # soft wrap, otherwise rich breaks lines that are wider than the console,
+    # which would mangle the tree
+    get_console().print(text, soft_wrap=True)
+
 
 def walk_tree(
     node: VALID_NODE_CHILD_TYPES | dict[str, VALID_NODE_CHILD_TYPES],
@@ -1,9 +1,11 @@
 """Tests for skops.io.visualize"""
 
+import io
 from unittest.mock import Mock, patch
 
 import pytest
 import sklearn
+from sklearn.base import clone
 from sklearn.linear_model import LogisticRegression
 from sklearn.pipeline import FeatureUnion, Pipeline
 from sklearn.preprocessing import (
@@ -16,38 +18,72 @@ from sklearn.preprocessing import (
 import skops.io as sio
 
 
-class TestVisualizeTree:
-    @pytest.fixture
-    def simple(self):
-        return MinMaxScaler(feature_range=(-555, 123))
+# The fixtures are module scoped because creating, fitting, and dumping the
+# estimators is the expensive part of these tests. Tests must therefore not
+# mutate them.
+@pytest.fixture(scope="module")
+def simple():
+    return MinMaxScaler(feature_range=(-555, 123))
 
-    @pytest.fixture
-    def pipeline(self):
-        def unsafe_function(x):
-            return x
-
-        # fmt: off
-        pipeline = Pipeline([
-            ("features", FeatureUnion([
-                ("scaler", StandardScaler()),
-                ("scaled-poly", Pipeline([
-                    ("polys", FeatureUnion([
-                        ("poly1", PolynomialFeatures()),
-                        ("poly2", PolynomialFeatures(degree=3, include_bias=False))
-                    ])),
-                    ("square-root", FunctionTransformer(unsafe_function)),
-                    ("scale", MinMaxScaler()),
+
+@pytest.fixture(scope="module")
+def simple_dumped(simple):
+    return sio.dumps(simple)
+
+
+@pytest.fixture(scope="module")
+def simple_skops_path(simple, tmp_path_factory):
+    f_name = tmp_path_factory.mktemp("visualize") / "estimator.skops"
+    sio.dump(simple, f_name)
+    return f_name
+
+
+class UnsafeType:
+    pass
+
+
+@pytest.fixture(scope="module")
+def simple_unsafe_dumped(simple):
+    # like simple, but with an attribute of an untrusted type; don't mutate the
+    # module scoped fixture
+    est = clone(simple)
+    est.copy = UnsafeType
+    return sio.dumps(est)
+
+
+@pytest.fixture(scope="module")
+def pipeline():
+    def unsafe_function(x):
+        return x
+
+    # fmt: off
+    pipeline = Pipeline([
+        ("features", FeatureUnion([
+            ("scaler", StandardScaler()),
+            ("scaled-poly", Pipeline([
+                ("polys", FeatureUnion([
+                    ("poly1", PolynomialFeatures()),
+                    ("poly2", PolynomialFeatures(degree=3, include_bias=False))
                 ])),
+                ("square-root", FunctionTransformer(unsafe_function)),
+                ("scale", MinMaxScaler()),
             ])),
-            ("clf", LogisticRegression(random_state=0, solver="liblinear")),
-        ]).fit([[0, 1], [2, 3], [4, 5]], [0, 1, 2])
-        # fmt: on
-        return pipeline
+        ])),
+        ("clf", LogisticRegression(random_state=0, solver="liblinear")),
+    ]).fit([[0, 1], [2, 3], [4, 5]], [0, 1, 2])
+    # fmt: on
+    return pipeline
+
 
+@pytest.fixture(scope="module")
+def pipeline_dumped(pipeline):
+    return sio.dumps(pipeline)
+
+
+class TestVisualizeTree:
     @pytest.mark.parametrize("show", ["all", "trusted", "untrusted"])
-    def test_print_simple(self, simple, show, capsys):
-        file = sio.dumps(simple)
-        sio.visualize(file, show=show)
+    def test_print_simple(self, simple_dumped, show, capsys):
+        sio.visualize(simple_dumped, show=show)
 
         # Output is the same for "all" and "trusted" because all nodes are
         # trusted. Colors are not recorded by capsys.
@@ -68,9 +104,8 @@ class TestVisualizeTree:
         stdout, _ = capsys.readouterr()
         assert stdout.strip() == "\n".join(expected)
 
-    def test_print_pipeline(self, pipeline, capsys):
-        file = sio.dumps(pipeline)
-        sio.visualize(file)
+    def test_print_pipeline(self, pipeline_dumped, capsys):
+        sio.visualize(pipeline_dumped)
 
         # no point in checking the whole output with > 120 lines
         expected_start = [
@@ -90,14 +125,30 @@ class TestVisualizeTree:
         assert stdout.startswith("\n".join(expected_start))
         assert stdout.rstrip().endswith("\n".join(expected_end))
 
-    def test_unsafe_nodes(self, pipeline):
-        file = sio.dumps(pipeline)
+    def test_long_lines_not_wrapped(self, pipeline_dumped, capsys):
+        # lines wider than the console should not be broken up, each node
+        # should be printed on exactly one line
         nodes = []
 
         def sink(nodes_iter, *args, **kwargs):
             nodes.extend(nodes_iter)
 
-        sio.visualize(file, sink=sink)
+        sio.visualize(pipeline_dumped, sink=sink)
+        sio.visualize(pipeline_dumped)
+
+        stdout, _ = capsys.readouterr()
+        lines = stdout.rstrip().split("\n")
+        assert max(len(line) for line in lines) > 80
+        assert len(lines) == len(nodes)
+        assert all(("├──" in line) or ("└──" in line) for line in lines[1:])
+
+    def test_unsafe_nodes(self, pipeline_dumped):
+        nodes = []
+
+        def sink(nodes_iter, *args, **kwargs):
+            nodes.extend(nodes_iter)
+
+        sio.visualize(pipeline_dumped, sink=sink)
         nodes_self_unsafe = [node for node in nodes if not node.is_self_safe]
         nodes_unsafe = [node for node in nodes if not node.is_safe]
 
@@ -117,12 +168,11 @@ class TestVisualizeTree:
     @pytest.mark.parametrize(
         "trusted", [True, ["numpy.int64", "test_visualize.unsafe_function"]]
     )
-    def test_all_nodes_trusted(self, pipeline, trusted, capsys):
+    def test_all_nodes_trusted(self, pipeline_dumped, trusted, capsys):
         # The pipeline contains untrusted type(s), but if we pass trusted=True,
         # it is not considered untrusted anymore
         # TODO: remove numpy.int64 from trusted once it's trusted by default
-        file = sio.dumps(pipeline)
-        sio.visualize(file, show="untrusted", trusted=trusted)
+        sio.visualize(pipeline_dumped, show="untrusted", trusted=trusted)
         expected = "root: sklearn.pipeline.Pipeline"
         stdout, _ = capsys.readouterr()
         assert stdout.strip() == expected
@@ -135,23 +185,16 @@ class TestVisualizeTree:
             {"tag_unsafe": "<careful>", "color_unsafe": "blue"},
         ],
     )
-    def test_custom_print_config_passed_to_sink(self, simple, kwargs):
+    def test_custom_print_config_passed_to_sink(self, simple_dumped, kwargs):
         # check that arguments are passed to sink
         def my_sink(nodes_iter, show, **sink_kwargs):
             for key, val in kwargs.items():
                 assert sink_kwargs[key] == val
 
-        file = sio.dumps(simple)
-        sio.visualize(file, sink=my_sink, **kwargs)
-
-    def test_custom_tags(self, simple, capsys):
-        class UnsafeType:
-            pass
-
-        simple.copy = UnsafeType
+        sio.visualize(simple_dumped, sink=my_sink, **kwargs)
 
-        file = sio.dumps(simple)
-        sio.visualize(file, tag_safe="NICE", tag_unsafe="OHNO")
+    def test_custom_tags(self, simple_unsafe_dumped, capsys):
+        sio.visualize(simple_unsafe_dumped, tag_safe="NICE", tag_unsafe="OHNO")
         expected = [
             "root: sklearn.preprocessing._data.MinMaxScaler NICE",
             "└── attrs: builtins.dict NICE",
@@ -168,53 +211,92 @@ class TestVisualizeTree:
         stdout, _ = capsys.readouterr()
         assert stdout.strip() == "\n".join(expected)
 
-    def test_custom_colors(self, simple):
+    def test_custom_colors(self, simple_unsafe_dumped):
         # test that custom colors are used in node representation, requires rich
         # to work
         pytest.importorskip("rich")
 
-        class UnsafeType:
-            pass
-
-        simple.copy = UnsafeType
-        file = sio.dumps(simple)
-
         # Colors are not recorded by capsys, so we cannot use it and must mock
         # printing
-        mock_print = Mock()
-        with patch("rich.print", mock_print):
+        mock_console = Mock()
+        with patch("rich.get_console", return_value=mock_console):
             sio.visualize(
-                file,
+                simple_unsafe_dumped,
                 color_safe="black",
                 color_unsafe="cyan",
                 color_child_unsafe="orange3",
             )
 
-        mock_print.assert_called()
+        # the whole tree is printed with a single call
+        mock_console.print.assert_called_once()
 
-        calls = mock_print.call_args_list
+        def get_styled(line):
+            # return the styled part of the line and its style
+            ((start, end, style),) = line.spans
+            return line.plain[start:end], style
+
+        lines = mock_console.print.call_args.args[0].split("\n")
         # The root node is indirectly unsafe through child
-        assert (
-            calls[0].args[0]
-            == "root: [orange3]sklearn.preprocessing._data.MinMaxScaler"
+        assert get_styled(lines[0]) == (
+            "sklearn.preprocessing._data.MinMaxScaler",
+            "orange3",
         )
         # 'feature_range' is safe
-        assert calls[6].args[0] == " feature_range: [black]builtins.tuple"
+        assert lines[2].plain == "    ├── feature_range: builtins.tuple"
+        assert get_styled(lines[2]) == ("builtins.tuple", "black")
         # 'copy' is unsafe
-        assert calls[15].args[0] == " copy: [cyan]test_visualize.UnsafeType [UNSAFE]"
+        assert get_styled(lines[5]) == (
+            "test_visualize.UnsafeType [UNSAFE]",
+            "cyan",
+        )
+
+    @pytest.fixture
+    def terminal_console(self):
+        # a console that writes colors to a buffer even though it's no terminal
+        rich_console = pytest.importorskip("rich.console")
+        console = rich_console.Console(
+            file=io.StringIO(), force_terminal=True, color_system="standard"
+        )
+        with patch("rich.get_console", return_value=console):
+            yield console
+
+    def test_theme_colors(self, simple_dumped, terminal_console):
+        # colors are resolved by rich when rendering, so theme styles work, same
+        # as with markup
+        sio.visualize(simple_dumped, color_safe="repr.number")
+
+        from rich.color import ColorSystem
+
+        style = terminal_console.get_style("repr.number")
+        expected = style.render(
+            "sklearn.preprocessing._data.MinMaxScaler",
+            color_system=ColorSystem.STANDARD,
+        )
+        assert expected.startswith("\x1b[")  # sanity check that it is colored
+        output = terminal_console.file.getvalue()
+        assert output.startswith("root: " + expected)
+
+    def test_unknown_colors(self, simple_dumped, terminal_console):
+        # colors are resolved by rich when rendering, so unknown colors are
+        # ignored, same as with markup
+        sio.visualize(simple_dumped, color_safe="not_a_color")
+
+        output = terminal_console.file.getvalue()
+        assert output.startswith("root: sklearn.preprocessing._data.MinMaxScaler")
+        # all nodes are safe, so no color at all should be used
+        assert "\x1b[" not in output
 
     @pytest.mark.usefixtures("rich_not_installed")
-    def test_no_colors_if_rich_not_installed(self, simple):
+    def test_no_colors_if_rich_not_installed(self, simple_dumped):
         # this test is similar to the previous one, except that we test that the
         # colors are *not* used if rich is not installed
-        file = sio.dumps(simple)
 
         # don't use capsys, because it wouldn't capture the colors, thus need to
         # use mock
         mock_print = Mock()
         with patch("builtins.print", mock_print):
             sio.visualize(
-                file,
+                simple_dumped,
                 color_safe="black",
                 color_unsafe="cyan",
                 color_child_unsafe="orange3",
@@ -222,40 +304,50 @@ class TestVisualizeTree:
         mock_print.assert_called()
 
         # check that none of the colors are being used
-        colors = ("black", "cyan", "orange3")
-        for call in mock_print.call_args_list:
-            for color in colors:
-                assert color not in call.args[0]
+        output = "\n".join(call.args[0] for call in mock_print.call_args_list)
+        for color in ("black", "cyan", "orange3"):
+            assert color not in output
 
-    def test_no_colors_if_use_colors_false(self, simple):
+    def test_no_colors_if_use_colors_false(self, simple_dumped):
         # this test is similar to the previous one, except that we test that the
         # colors are *not* used, even if rich is installed, when passing
         # use_colors=False
-        file = sio.dumps(simple)
 
         # don't use capsys, because it wouldn't capture the colors, thus need to
         # use mock
-        mock_print = Mock()
-        with patch("rich.print", mock_print):
+        mock_console = Mock()
+        with patch("rich.get_console", return_value=mock_console):
             sio.visualize(
-                file,
+                simple_dumped,
                 color_safe="black",
                 color_unsafe="cyan",
                 color_child_unsafe="orange3",
                 use_colors=False,
             )
-        mock_print.assert_called()
+        mock_console.print.assert_called()
 
         # check that none of the colors are being used
-        colors = ("black", "cyan", "orange3")
-        for call in mock_print.call_args_list:
-            for color in colors:
-                assert color not in call.args[0]
-
-    def test_from_file(self, simple, tmp_path, capsys):
-        f_name = tmp_path / "estimator.skops"
-        sio.dump(simple, f_name)
-        sio.visualize(f_name)
+        output = "\n".join(
+            str(call.args[0]) for call in mock_console.print.call_args_list
+        )
+        for color in ("black", "cyan", "orange3"):
+            assert color not in output
+
+    @pytest.mark.parametrize("use_colors", [True, False])
+    def test_markup_printed_literally(self, use_colors, capsys):
+        # keys and values that look like rich markup should be printed as is
+        obj = {"[bold]key[/bold]": "[red]value"}
+        sio.visualize(sio.dumps(obj), use_colors=use_colors)
+
+        expected = [
+            "root: builtins.dict",
+            '└── [bold]key[/bold]: json-type("[red]value")',
+        ]
+        stdout, _ = capsys.readouterr()
+        assert stdout.strip() == "\n".join(expected)
+
+    def test_from_file(self, simple_skops_path, capsys):
+        sio.visualize(simple_skops_path)
 
         expected = [
             "root: sklearn.preprocessing._data.MinMaxScaler",